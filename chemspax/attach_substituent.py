@@ -12,9 +12,10 @@ import pandas as pd
 from openbabel import openbabel
 from pathlib import Path
 
-from chemspax.utilities import get_bonded_atoms, scale_vector, convert_list_of_string_to_np_array, \
-    print_mol_counts_block, print_correct_connectivity_line, remove_last_line, convert_xyz_2_mol_file, \
-    read_connectivity_from_mol_file, ff_optimize
+from chemspax.utilities import get_bonded_atoms, convert_list_of_string_to_np_array, \
+    print_mol_counts_block, print_correct_connectivity_line, convert_xyz_2_mol_file, \
+    read_connectivity_from_mol_file, ff_optimize, read_xyz_file, get_rotation_matrix, get_rotation_matrices, \
+    read_csv_database
 """A substituent from the library can be attached to another molecule with the functions given in this file. 
 The substituent is seen as a 'rigid block' that is rotated and translated. After placement of a new substituent, the 
 new substituent is optimized with openbabel's FF methods. This is a constrained optimization since the skeleton 
@@ -47,7 +48,8 @@ class Substituent:
         if len(self.data_matrix) == 0:
             raise ValueError('Substituent .xyz is empty')
         self.central_atom_index = central_atom
-        self.central_atom = self.data_matrix.loc[self.central_atom_index, ['x', 'y', 'z']]  # get xyz coordinate of central atom
+        self.coordinates = self.data_matrix[['x', 'y', 'z']].to_numpy()
+        self.central_atom = self.coordinates[self.central_atom_index]  # get xyz coordinate of central atom
 
     def scale(self, vector, central_atom):
         """Function used to scale a vector to the given input bond length
@@ -87,14 +89,12 @@ class Substituent:
 
         # find atoms bonded to central atom of substituent, use mol file since graph representation is more accurate
         edges = get_bonded_atoms(self.path[:-4]+'.mol', self.central_atom_index)
-        # scale bonds such that an hypothetical symmetrical molecule is created say C-X' C-Y' C-Z'
-        for i in range(np.shape(edges)[0]):
-            scale_vector(self.central_atom, (edges[i, :]-self.central_atom), self.bond_length)
-        # calculate centroid of this hypothetical molecule, which will be similar to real molecule
+        # calculate centroid of the bonded atoms
         centroid = np.sum(edges, axis=0)/edges.shape[0]  # sum over rows and divide by amount of atoms found
         # get correct orientation of total group s.t. the centroid vector is pointing towards the bond to be made
-        centroid = (centroid - self.central_atom)/np.linalg.norm(centroid - self.central_atom)
-        return np.array(centroid)
+        centroid = centroid - self.central_atom
+        centroid = centroid/np.linalg.norm(centroid)
+        return centroid
 
     def write_central_atom_and_centroid_to_csv(self):
         """Write the central atom and centroid data of the substituent to the csv database
@@ -109,7 +109,9 @@ class Substituent:
         if len(self.data_matrix) != 1:
             centroid = self.first_coordination()
         else:
-            centroid = np.array(self.central_atom.values)
+            centroid = self.central_atom
+        # write every component with full precision, str() of a float array would round them to 8 digits
+        centroid = '[' + ' '.join(str(float(x)) for x in centroid) + ']'
         write_data = pd.DataFrame([[self.molecule, int(self.central_atom_index), centroid]],
                                   columns=["group_to_be_attached", "central_atom_index", "centroid"])\
             .set_index("group_to_be_attached")
@@ -144,8 +146,7 @@ class Complex:
         self.skeleton_path = source_data
         # for the first usage this is purely the skeleton, for recursive usage it's skeleton + prev. functionalization
         try:
-            self.skeleton_xyz = pd.read_table(self.skeleton_path, skiprows=2, delim_whitespace=True,
-                                             names=['atom', 'x', 'y', 'z'])  # read standard .xyz file
+            self.skeleton_atoms, self.skeleton_xyz = read_xyz_file(self.skeleton_path)  # read standard .xyz file
             if len(self.skeleton_xyz) == 0:
                 raise ValueError('Skeleton .xyz is empty')
         except:
@@ -158,22 +159,19 @@ class Complex:
         substituent_folder = path_to_substituents
         extension = '.xyz'
         self.substituent_path = os.path.join(substituent_folder, self.substituent_molecule + extension)
-        self.substituent_xyz = pd.read_table(self.substituent_path, skiprows=2, delim_whitespace=True,
-                                         names=['atom', 'x', 'y', 'z'])  # read standard .xyz file
+        self.substituent_atoms, self.substituent_xyz = read_xyz_file(self.substituent_path)  # read standard .xyz file
         if len(self.substituent_xyz) == 0:
             raise ValueError('Substituent .xyz is empty')
-        self.database_df = pd.read_csv(path_to_database, delimiter=',')
-                                       # ,converters={'centroid': convert_list_of_string_to_np_array})
+        self.database_df = read_csv_database(path_to_database)
         try:
             self.substituent_df = self.database_df.loc[self.database_df['group_to_be_attached']
                                                        == self.substituent_molecule]
         except KeyError:
             raise KeyError
-        self.substituent_central_atom_index = int(self.substituent_df['central_atom_index'])
+        self.substituent_central_atom_index = int(self.substituent_df['central_atom_index'].iat[0])
         self.substituent_centroid_vector = self.substituent_df['centroid'].values
         self.substituent_centroid_vector = convert_list_of_string_to_np_array(self.substituent_centroid_vector)
-        self.substituent_central_atom_xyz = self.substituent_xyz.loc[
-            self.substituent_central_atom_index, ['x', 'y', 'z']]
+        self.substituent_central_atom_xyz = self.substituent_xyz[self.substituent_central_atom_index]
 
         # get functionalization list from source file
         with open(self.skeleton_path) as f:
@@ -196,16 +194,14 @@ class Complex:
             print('No more indices left. Exiting program')
             sys.exit(1)
 
-        self.skeleton_atom_to_be_functionalized_xyz = self.skeleton_xyz.loc[
-            self.skeleton_atom_to_be_functionalized_index, [
-                'x', 'y', 'z']]  # get xyz coordinate of atom to be functionalized - H
-        self.skeleton_bonded_atom_xyz = self.skeleton_xyz.loc[
-            self.skeleton_bonded_atom_index, [
-                'x', 'y', 'z']]  # get xyz coordinate of bonded atom - C (in CH3: C= central atom)
+        # get xyz coordinate of atom to be functionalized - H
+        self.skeleton_atom_to_be_functionalized_xyz = self.skeleton_xyz[self.skeleton_atom_to_be_functionalized_index]
+        # get xyz coordinate of bonded atom - C (in CH3: C= central atom)
+        self.skeleton_bonded_atom_xyz = self.skeleton_xyz[self.skeleton_bonded_atom_index]
         self.bond_length = self.skeleton_atom_to_be_functionalized_xyz \
                          - self.skeleton_bonded_atom_xyz  # vector with origin on C and points to H in xyz plane
-        self.normalized_bond_vector = self.bond_length / np.linalg.norm(
-            self.bond_length)  # real bond between C-H in xyz plane
+        self.bond_length_norm = np.linalg.norm(self.bond_length)  # computed once, reused for every placement
+        self.normalized_bond_vector = self.bond_length / self.bond_length_norm  # real bond between C-H in xyz plane
 
     def create_functionalization_list_all_hydrogens(self):
         # ToDo: use an unconventional dummy atom (such as Br) instead of H to replace with substituent
@@ -248,38 +244,51 @@ class Complex:
         :param length_skeleton_bonded_substituent_central: bond length between the substituent group and skeleton
         :return: xyz matrix with correctly rotated and translated coordinates of substituent group's atoms
         """
-        normal_vector = self.substituent_centroid_vector
-        # normal_vector = normal_vector / np.linalg.norm(normal_vector)  # vector is already unit vector (redundant)
-
-        # construct rotation matrix
-        bond_length_norm = np.array(self.normalized_bond_vector.astype('float64'))
-
-        # https://math.stackexchange.com/questions/180418/calculate-rotation-matrix-to-align-vector-a-to-vector-b-in-3d
-        v = np.cross(normal_vector.T, bond_length_norm.T)  # v is perpendicular to normal vector and bond between C-H
-        v_x = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
-        v_xsq = np.dot(v_x, v_x)
-        c = np.dot(bond_length_norm.T, normal_vector.T)
-        if c != -1.0:
-            rotation_matrix = np.eye(3) + v_x + v_xsq * (1 / (1 + c))
-        else:
-            rotation_matrix = np.eye(3)
+        # construct rotation matrix, substituent_centroid_vector is already a unit vector and normalized_bond_vector is
+        # already a float64 array (see __init__)
+        rotation_matrix = get_rotation_matrix(self.substituent_centroid_vector, self.normalized_bond_vector)
 
-        n_atoms, n_columns = len(self.substituent_xyz), len(self.substituent_xyz.columns)  # atoms in substituent group
-        substituent_vectors = np.array(self.substituent_xyz.loc[:, ['x', 'y', 'z']].values)  # xyz only
         # calculate new position of substituent_central_atom, the other atoms will be placed around this
-        new_position_substiuent = np.array(scale_vector(self.skeleton_bonded_atom_xyz,
-                            (self.skeleton_atom_to_be_functionalized_xyz - self.skeleton_bonded_atom_xyz),
-                            float(length_skeleton_bonded_substituent_central)))
-
-        # do rotation first
-        for i in range(n_atoms):
-            substituent_vectors[i, :] = np.dot(rotation_matrix, substituent_vectors[i, :].T)
-        # save copy of correctly rotated central atom of substituent
-        substituent_central_atom = substituent_vectors[self.substituent_central_atom_index, :].copy()
+        # same as scale_vector() on the bond, but reuses the bond vector that is already normalized in __init__
+        new_position_substiuent = self.skeleton_bonded_atom_xyz + \
+            self.normalized_bond_vector * float(length_skeleton_bonded_substituent_central)
+
+        # do rotation first, rotate all atoms (rows) of the substituent at once
+        substituent_vectors = self.substituent_xyz @ rotation_matrix.T
+        # correctly rotated central atom of substituent
+        substituent_central_atom = substituent_vectors[self.substituent_central_atom_index, :]
         # do translation after
-        for i in range(n_atoms):
-            # ToDo: for O-CH3 do new_position_substituent - Oxygen, how to detect these cases?
-            substituent_vectors[i, :] = substituent_vectors[i, :] + (new_position_substiuent - substituent_central_atom)
+        # ToDo: for O-CH3 do new_position_substituent - Oxygen, how to detect these cases?
+        substituent_vectors += new_position_substiuent - substituent_central_atom
+        return substituent_vectors
+
+    def generate_substituent_group_vectors_all_sites(self, length_skeleton_bonded_substituent_central=1.54,
+                                                     dtype=np.float64):
+        """Same as generate_substituent_group_vector, but places the substituent group on every site of the
+        functionalization list at once. Each site is treated independently, so the placements do not see each other and
+        nothing is written to file.
+
+        :param length_skeleton_bonded_substituent_central: bond length between the substituent group and skeleton
+        :param dtype: float type of the returned coordinates, np.float32 halves the memory of the result for many sites.
+        The rotation matrices are always constructed in float64
+        :return: (n_sites, n_atoms_substituent, 3) array with rotated and translated coordinates of substituent group's
+        atoms for each site
+        """
+        site_indices = np.array(self.functionalization_site_list, dtype=int).reshape(-1, 2)
+        atoms_to_be_functionalized_xyz = self.skeleton_xyz[site_indices[:, 0]]
+        bonded_atoms_xyz = self.skeleton_xyz[site_indices[:, 1]]
+        bond_vectors = atoms_to_be_functionalized_xyz - bonded_atoms_xyz
+        normalized_bond_vectors = bond_vectors / np.linalg.norm(bond_vectors, axis=1)[:, None]
+
+        rotation_matrices = get_rotation_matrices(self.substituent_centroid_vector, normalized_bond_vectors)
+        # rotate all atoms of the substituent for all sites at once
+        substituent_vectors = np.einsum('nij,kj->nki', rotation_matrices.astype(dtype),
+                                        self.substituent_xyz.astype(dtype))
+        # translate rotated central atom of substituent to its new position for each site
+        new_positions_substituent = (bonded_atoms_xyz + normalized_bond_vectors *
+                                     float(length_skeleton_bonded_substituent_central)).astype(dtype)
+        substituent_vectors += (new_positions_substituent -
+                                substituent_vectors[:, self.substituent_central_atom_index, :])[:, None, :]
         return substituent_vectors
 
     def write_connectivity_in_file(self, target_path, new_connectivity_data):
@@ -295,45 +304,24 @@ class Complex:
         new_connectivity_data = new_connectivity_data.astype(int)
 
         # save first part of file to write later
-        lines = open(target_path).readlines()
+        with open(target_path) as f:
+            lines = f.readlines()
         n_atoms = len(self.skeleton_xyz) - 1 + len(self.substituent_xyz)
         n_atoms_and_comments = n_atoms + 4
 
         first_part = lines[:n_atoms_and_comments]
         first_part[3] = print_mol_counts_block(first_part[3], n_atoms, len(new_connectivity_data))  # correct counts
-        # read data and skip first 4 lines
-        all_data = pd.read_table(target_path, skiprows=4, delim_whitespace=True, header=None)
-        # fill NaN with space & save ending line to write at end of file
-        end_line = all_data.fillna('').iloc[[-1]]
-
-        # write new .mol file correctly
-        os.remove(target_path)  # delete original file to prevent errors
-        with open(target_path, 'w') as wr:
-            wr.writelines(first_part)
+        # save ending line ('M  END') to write at end of file
+        end_line = lines[-1].rstrip('\r\n') + '\n'
 
         # connectivity is separated by 2 spaces (I thought), but this is not correct for the official .mol format
-        # I couldn't find a way to directly write every digit in the correct format from dataframe to file
-        # so now the dataframe is first written and string formatting is done afterwards
-        f = open(target_path, 'ab')  # open file in binary to be able to append with np.savetxt
-        np.savetxt(f, new_connectivity_data, delimiter='  ', fmt='%d')  # pd doesn't support '  ' as delimiter :(
-        f.close()
-
         # add correct spacing of connectivity table for official .mol format, each number has 3 allocated spaces
-        f = open(target_path, 'r')
-        lines = f.readlines()
-        connectivity_lines_only = lines[n_atoms_and_comments:]
-        newlines = []
-        for line in connectivity_lines_only:
-            line = print_correct_connectivity_line(line)
-            newlines.append(line)
-        wr = open(target_path, 'w')
-        lines_above_connectivity_lines = lines[:n_atoms_and_comments]
-        wr.writelines(lines_above_connectivity_lines + newlines)
-        wr.close()
-
-        f = open(target_path, 'ab')  # open file in binary to be able to append with np.savetxt
-        np.savetxt(f, end_line, delimiter='  ', fmt="%s")  # pd doesn't support '  ' as delimiter :(
-        f.close()
+        connectivity_lines = [print_correct_connectivity_line('  '.join(str(item) for item in row) + '\n')
+                              for row in new_connectivity_data.to_numpy()]
+
+        # write new .mol file correctly, in one go
+        with open(target_path, 'w') as wr:
+            wr.writelines(first_part + connectivity_lines + [end_line])
 
     def generate_substituent_and_write_xyz(self, target_filename, path_to_output, length_skeleton_bonded_substituent_central=1.54,
                                            use_xtb_script_after=True):
@@ -354,11 +342,10 @@ class Complex:
 
         # replace substituent x y z with newly calculated positions
         substituent_vectors = self.generate_substituent_group_vector(float(length_skeleton_bonded_substituent_central))
-        substituents_new_data = self.substituent_xyz.copy()  # always copy a df to modify it!
-        substituents_new_data.loc[:, ['x', 'y', 'z']] = substituent_vectors
         # remove skeleton_atom_to_be_functionalized and place substituent data at end of file
-        skeleton_new_data = self.skeleton_xyz.copy()
-        skeleton_new_data = skeleton_new_data.drop([self.skeleton_atom_to_be_functionalized_index])
+        skeleton_new_atoms = [atom for i, atom in enumerate(self.skeleton_atoms)
+                              if i != self.skeleton_atom_to_be_functionalized_index]
+        skeleton_new_data = np.delete(self.skeleton_xyz, self.skeleton_atom_to_be_functionalized_index, axis=0)
 
         # old method: write substituent central atom at atom_to_be_functinoalized and paste rest of sub. to bottom
         # skeleton_new_data.loc[self.skeleton_atom_to_be_functionalized_index, :] = \
@@ -367,39 +354,31 @@ class Complex:
         # substituents_new_data = substituents_new_data.drop([self.substituent_central_atom_index])
 
         # since atom_to_be_functionalized is dropped, indices in functionalization list need to shift
+        # the shifted indices are kept local, so the state of this instance is the same after every call
         # shift bonded_atom first
-        self.skeleton_bonded_atom_index = self.skeleton_bonded_atom_index - 1 if self.skeleton_bonded_atom_index > self\
+        skeleton_bonded_atom_index = self.skeleton_bonded_atom_index - 1 if self.skeleton_bonded_atom_index > self\
             .skeleton_atom_to_be_functionalized_index else self.skeleton_bonded_atom_index
-        # make nested list as big as functionalization list
-        new_functionalization_list = [[] for i in range(len(self.functionalization_site_list))]
-        for i in range(len(self.functionalization_site_list)):
-            some_list = self.functionalization_site_list[i]
-            for j in range(len(some_list)):
-                item = some_list[j]
-                # shift is only needed if item contains index larger than atom to be functionalized
-                item = item - 1 if item > self.skeleton_atom_to_be_functionalized_index else item
-                some_list[j] = item
-            new_functionalization_list[i] = some_list
-        self.functionalization_site_list = new_functionalization_list[1:]  # remove first element, which is functionalized
-
-        # concat both dataframes and write to file
-        write_data = pd.concat([skeleton_new_data, substituents_new_data])
-        write_data = write_data.astype({'x': float, 'y': float, 'z': float})  # correct types in df
-        write_data = write_data.set_index('atom')
+        # shift is only needed if item contains index larger than atom to be functionalized
+        new_functionalization_list = [[item - 1 if item > self.skeleton_atom_to_be_functionalized_index else item
+                                       for item in some_list] for some_list in self.functionalization_site_list]
+        new_functionalization_list = new_functionalization_list[1:]  # remove first element, which is functionalized
+
+        # concat skeleton and substituent data
+        write_atoms = skeleton_new_atoms + self.substituent_atoms
+        write_data = np.concatenate([skeleton_new_data, substituent_vectors]).tolist()
         # # check if there is overlap between atoms and then ToDO: then what? Not necessary if ff_opt works
         # is_there_overlap, overlapping_atoms = check_overlap(write_data)
         # print(is_there_overlap, overlapping_atoms)
         # increase n_atoms of source file accordingly
         with open(self.skeleton_path) as f:
             n_atoms = int(f.readline())
-        n_atoms += len(substituents_new_data) - 1  # atom_to_be_functionalized is dropped so 1 less atom to count
-        # write to file
+        n_atoms += len(substituent_vectors) - 1  # atom_to_be_functionalized is dropped so 1 less atom to count
+        # write to file, without a whiteline at the end
+        lines = [str(n_atoms) + '\n', str(new_functionalization_list) + '\n']
+        lines += [f'{atom} {x} {y} {z}\n' for atom, (x, y, z) in zip(write_atoms, write_data)]
+        lines[-1] = lines[-1].rstrip('\n')
         with open(target_path, 'w') as wr:
-            wr.write(str(n_atoms) + '\n')
-            wr.write(str(self.functionalization_site_list) + '\n')
-        write_data.to_csv(target_path, sep=' ', header=False, mode='a')
-        # remove last whiteline generated by pandas' to_csv function
-        remove_last_line(target_path)
+            wr.writelines(lines)
 
         # fix bug with bonds being formed & weirdly broken
         # remember, indexing in .mol files starts from 1 for some reason...
@@ -427,7 +406,7 @@ class Complex:
             lambda x: x-1 if x > self.skeleton_atom_to_be_functionalized_index+1 else x)
 
         # append new bond between substituent_central_atom and skeleton_bonded_atom
-        new_bond = pd.DataFrame({0: [new_substituent_central_atom_index], 1: [self.skeleton_bonded_atom_index+1],
+        new_bond = pd.DataFrame({0: [new_substituent_central_atom_index], 1: [skeleton_bonded_atom_index+1],
                                  2: [1], 3: [0], 4: [0], 5: [0], 6: [0]})
         skeleton_connectivity = skeleton_connectivity.append(new_bond)
         skeleton_connectivity = skeleton_connectivity.astype(int)
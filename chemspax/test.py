@@ -44,6 +44,48 @@ def test_find_distance():
     os.remove(test_folder+'CH3.xyz')
 
 
+def test_distance():
+    assert distance([0.0, 0.0, 0.0], [1.0, 2.0, 2.0]) == 3.0
+
+
+def test_get_rotation_matrix():
+    normal_vector = np.array([0.0, 0.0, 1.0])
+    target_vector = np.array([1.0, 2.0, 2.0]) / 3
+    rotation_matrix = get_rotation_matrix(normal_vector, target_vector)
+    assert np.allclose(rotation_matrix @ normal_vector, target_vector)
+    assert np.allclose(rotation_matrix @ rotation_matrix.T, np.eye(3))
+
+
+def test_get_rotation_matrix_antiparallel():
+    normal_vector = np.array([1.0, 2.0, 2.0]) / 3
+    rotation_matrix = get_rotation_matrix(normal_vector, -normal_vector)
+    assert np.allclose(rotation_matrix @ normal_vector, -normal_vector)
+    assert np.allclose(rotation_matrix @ rotation_matrix.T, np.eye(3))
+    assert np.isclose(np.linalg.det(rotation_matrix), 1.0)
+
+
+def test_get_rotation_matrices():
+    normal_vector = np.array([0.0, 0.6, 0.8])
+    target_vectors = np.array([[1.0, 2.0, 2.0], [0.0, 0.0, 1.0], [0.0, -0.6, -0.8], [0.0, 0.6, 0.8]])
+    target_vectors = target_vectors / np.linalg.norm(target_vectors, axis=1)[:, None]
+    rotation_matrices = get_rotation_matrices(normal_vector, target_vectors)
+    assert rotation_matrices.shape == (4, 3, 3)
+    for rotation_matrix, target_vector in zip(rotation_matrices, target_vectors):
+        assert np.allclose(rotation_matrix, get_rotation_matrix(normal_vector, target_vector))
+
+
+def test_read_csv_database():
+    filename = test_folder + 'database.csv'
+    with open(filename, 'w') as wr:
+        wr.write('group_to_be_attached,central_atom_index,centroid\nF,0,[0.0 0.0 0.0]\n')
+    database = read_csv_database(filename)
+    assert read_csv_database(filename) is database
+    with open(filename, 'a') as wr:
+        wr.write('CH3,0,[0.0 0.0 1.0]\n')
+    assert list(read_csv_database(filename)['group_to_be_attached']) == ['F', 'CH3']
+    os.remove(filename)
+
+
 def test_remove_last_line():
     filename = 'random_file.txt'
     create_random_file(filename)
@@ -3,6 +3,10 @@
 #  __authors__ = Adarsh Kalikadien & Vivek Sinha      #
 #  __institution__ = TU Delft                         #
 #                                                     #
+import os
+import math
+import functools
+from io import StringIO
 import ase.io as io
 from ase.visualize import view
 import ase.build
@@ -20,8 +24,11 @@ openbabel.obErrorLog.SetOutputLevel(0)
 
 
 def distance(a, b):
-    d = a - b
-    return np.sqrt((d[0]) ** 2 + (d[1]) ** 2 + (d[2]) ** 2)
+    # plain scalar math, np.sqrt and array subtraction only add overhead for a single 3-vector
+    ax, ay, az = a
+    bx, by, bz = b
+    dx, dy, dz = ax - bx, ay - by, az - bz
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
 
 
 def visualize_xyz_file(filename, save_picture=False, manually_generated=True):
@@ -64,6 +71,21 @@ def remove_last_line(filename):
         wr.writelines(lines)
 
 
+def read_xyz_file(filename):
+    """Read a standard .xyz file without going through pandas, the first 2 lines (n_atoms and comment) are skipped
+
+    :param filename:
+    :return: list of atom symbols and (n_atoms, 3) numpy array of xyz coordinates
+    """
+    with open(filename) as f:
+        lines = f.readlines()[2:]
+    # skip (trailing) whitelines
+    rows = [line.split() for line in lines if line.strip()]
+    atoms = [row[0] for row in rows]
+    coordinates = np.array([[float(x) for x in row[1:4]] for row in rows], dtype=np.float64).reshape(-1, 3)
+    return atoms, coordinates
+
+
 def create_molecule_and_write_xyz(input_molecule, filename):
     """
     https://wiki.fysik.dtu.dk/ase/ase/build/build.html?highlight=ase%20build%20molecule#ase.build.molecule
@@ -72,8 +94,11 @@ def create_molecule_and_write_xyz(input_molecule, filename):
     :return: 
     """
     molecule = ase.build.molecule(input_molecule)
-    molecule.write(filename, 'xyz')
-    remove_last_line(filename)
+    # write to memory first, so the last whiteline can be removed before the file is written only once
+    buffer = StringIO()
+    io.write(buffer, molecule, format='xyz')
+    with open(filename, 'w') as wr:
+        wr.write(buffer.getvalue().rstrip('\r\n'))
 
 
 def scale_vector(starting_point, vector, length):
@@ -253,6 +278,23 @@ def set_neighbour_bond_distance_search(source_mol_file, central_atom_atomic_num,
                     obconversion.WriteFile(mol, source_mol_file)
 
 
+@functools.lru_cache(maxsize=None)
+def _read_csv_database_cached(path_to_database, modification_time, size):
+    return pd.read_csv(path_to_database, delimiter=',')
+
+
+def read_csv_database(path_to_database):
+    """Read the .csv database with central atoms and centroid vectors of the substituents. The database is only parsed
+    again if the file has changed, so creating a Complex for every substituent does not re-read the same file.
+    The returned dataframe is shared between callers and should not be modified.
+
+    :param path_to_database:
+    :return: dataframe of .csv database
+    """
+    stat = os.stat(path_to_database)
+    return _read_csv_database_cached(os.path.abspath(path_to_database), stat.st_mtime_ns, stat.st_size)
+
+
 def convert_list_of_string_to_np_array(array_string):
     """Pandas is importing np arrays as strings, use this converter to convert the list of 1 string to a np.array
     https://stackoverflow.com/questions/42755214/how-to-keep-numpy-array-when-saving-pandas-dataframe-to-csv
@@ -272,6 +314,72 @@ def generate_random_rotation_matrix():
     return q
 
 
+def get_rotation_matrix(normal_vector, target_vector):
+    """Rotation matrix that rotates the unit vector normal_vector onto the unit vector target_vector
+    https://math.stackexchange.com/questions/180418/calculate-rotation-matrix-to-align-vector-a-to-vector-b-in-3d
+
+    If the vectors are antiparallel, c = -1 gives 1/0 in the formula above. In that case the vectors are aligned by
+    a rotation of 180 degrees around an axis perpendicular to normal_vector.
+
+    :param normal_vector:
+    :param target_vector:
+    :return: 3x3 rotation matrix
+    """
+    a1, a2, a3 = normal_vector
+    b1, b2, b3 = target_vector
+    c = a1 * b1 + a2 * b2 + a3 * b3
+    # close to c = -1 the 1/(1+c) term loses all precision, so switch to the 180 degree rotation before that
+    if 1 + c < 1e-10:
+        # rotation axis u = a x e_i, with e_i the unit axis that is least parallel to a
+        i = int(np.argmin(np.abs(normal_vector)))
+        u = np.cross(normal_vector, np.eye(3)[i])
+        u = u / np.linalg.norm(u)
+        return 2 * np.outer(u, u) - np.eye(3)
+
+    # v = a x b is perpendicular to normal vector and target vector, written out for 3-vectors
+    v1 = a2 * b3 - a3 * b2
+    v2 = a3 * b1 - a1 * b3
+    v3 = a1 * b2 - a2 * b1
+    # I + v_x + v_x @ v_x / (1 + c) written out entry by entry, with v_x the cross product matrix of v
+    # [[0, -v3, v2], [v3, 0, -v1], [-v2, v1, 0]] and v_x @ v_x = v v^T - |v|^2 I
+    k = 1 / (1 + c)
+    k11, k22, k33 = k * v1 * v1, k * v2 * v2, k * v3 * v3
+    k12, k13, k23 = k * v1 * v2, k * v1 * v3, k * v2 * v3
+    rotation_matrix = np.array([[1 - k22 - k33, k12 - v3, k13 + v2],
+                                [k12 + v3, 1 - k11 - k33, k23 - v1],
+                                [k13 - v2, k23 + v1, 1 - k11 - k22]])
+    return rotation_matrix
+
+
+def get_rotation_matrices(normal_vector, target_vectors):
+    """Vectorized get_rotation_matrix(), rotation matrices that rotate the unit vector normal_vector onto each of the
+    unit vectors in target_vectors
+
+    :param normal_vector:
+    :param target_vectors: (n, 3) array of unit vectors
+    :return: (n, 3, 3) array of rotation matrices
+    """
+    target_vectors = np.asarray(target_vectors, dtype=np.float64).reshape(-1, 3)
+    a1, a2, a3 = normal_vector
+    b1, b2, b3 = target_vectors.T
+    c = a1 * b1 + a2 * b2 + a3 * b3
+    v1 = a2 * b3 - a3 * b2
+    v2 = a3 * b1 - a1 * b3
+    v3 = a1 * b2 - a2 * b1
+    v_x = np.zeros((len(target_vectors), 3, 3))
+    v_x[:, 0, 1], v_x[:, 0, 2] = -v3, v2
+    v_x[:, 1, 0], v_x[:, 1, 2] = v3, -v1
+    v_x[:, 2, 0], v_x[:, 2, 1] = -v2, v1
+    v_xsq = np.einsum('nij,njk->nik', v_x, v_x)
+    # antiparallel vectors are handled separately by get_rotation_matrix, prevent 1/0 for those
+    antiparallel = 1 + c < 1e-10
+    k = 1 / (1 + np.where(antiparallel, 0.0, c))
+    rotation_matrices = np.eye(3) + v_x + v_xsq * k[:, None, None]
+    for i in np.flatnonzero(antiparallel):
+        rotation_matrices[i] = get_rotation_matrix(normal_vector, target_vectors[i])
+    return rotation_matrices
+
+
 def read_connectivity_from_mol_file(source_file, n_atoms):
     """Reads connectivity from a .mol file, each number in .mol file has 3 allocated spaces and the file looks like:
     idx1 idx2 bond_type bond_stereochemistry 0 0 0